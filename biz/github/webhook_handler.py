@@ -1,27 +1,23 @@
-import os
 import re
 import time
 
 import requests
 import fnmatch
+from biz.utils.file_util import SUPPORTED_EXTENSIONS
 from biz.utils.log import logger
 
 
-
 def filter_changes(changes: list):
     '''
     过滤数据，只保留支持的文件类型以及必要的字段信息
     专门处理GitHub格式的变更
     '''
-    # 从环境变量中获取支持的文件扩展名
-    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
-    
     # 筛选出未被删除的文件
     not_deleted_changes = []
     for change in changes:
         # 优先检查status字段是否为"removed"
         if change.get('status') == 'removed':
-            logger.info(f"Detected file deletion via status field: {change.get('new_path')}")
+            logger.info("Detected file deletion via status field: %s", change.get('new_path'))
             continue
             
         # 如果没有status字段或status不为"removed"，继续检查diff模式
@@ -32,13 +28,13 @@ def filter_changes(changes: list):
                 # 检查除了diff头部外的所有行是否都以减号开头
                 diff_lines = diff.split('\n')[1:]  # 跳过diff头部
                 if all(line.startswith('-') or not line for line in diff_lines):
-                    logger.info(f"Detected file deletion via diff pattern: {change.get('new_path')}")
+                    logger.info("Detected file deletion via diff pattern: %s", change.get('new_path'))
                     continue
                     
         not_deleted_changes.append(change)
     
-    logger.info(f"SUPPORTED_EXTENSIONS: {supported_extensions}")
-    logger.info(f"After filtering deleted files: {not_deleted_changes}")
+    logger.info("SUPPORTED_EXTENSIONS: %s", SUPPORTED_EXTENSIONS)
+    logger.debug("After filtering deleted files: %s", not_deleted_changes)
     
     # 过滤 `new_path` 以支持的扩展名结尾的元素, 仅保留diff和new_path字段
     filtered_changes = [
@@ -49,9 +45,9 @@ def filter_changes(changes: list):
             'deletions': item.get('deletions', 0),
         }
         for item in not_deleted_changes
-        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
+        if item.get('new_path', '').endswith(SUPPORTED_EXTENSIONS)
     ]
-    logger.info(f"After filtering by extension: {filtered_changes}")
+    logger.debug("After filtering by extension: %s", filtered_changes)
     return filtered_changes
 
 
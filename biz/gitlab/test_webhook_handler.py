@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 # @Time    : 2025/3/18 17:58
 # @Author  : Arrow
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from unittest import TestCase, main
+from unittest.mock import MagicMock, patch
 
-from biz.gitlab.webhook_handler import PushHandler
+from biz.gitlab.webhook_handler import MergeRequestHandler, PushHandler, filter_changes, split_branch_patterns, \
+    match_branch_patterns, slugify_url
 
 
 # @Describe:
@@ -31,6 +35,87 @@ class TestPushHandler(TestCase):
 
         self.assertTrue(parent_id)
 
+    def test_add_push_notes_uses_shared_session(self):
+        """测试评论请求通过共享Session发送"""
+        handler = PushHandler({'event_name': 'push', 'project': {'id': 1}, 'commits': [{'id': 'abc'}]},
+                              'token', 'https://gitlab.example.com')
+        session = MagicMock()
+        session.post.return_value.status_code = 201
+        with patch('biz.gitlab.webhook_handler.get_session', return_value=session):
+            handler.add_push_notes('LGTM')
+
+        args, kwargs = session.post.call_args
+        self.assertTrue(args[0].endswith('api/v4/projects/1/repository/commits/abc/comments'))
+        self.assertEqual(kwargs['headers'], {'Private-Token': 'token'})
+        self.assertEqual(kwargs['json'], {'note': 'LGTM'})
+
+
+class _ServiceUnavailableHandler(BaseHTTPRequestHandler):
+    requests_count = 0
+
+    def do_GET(self):
+        type(self).requests_count += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMergeRequestHandlerUnavailable(TestCase):
+    def setUp(self):
+        """启动始终返回 503 的本地服务"""
+        _ServiceUnavailableHandler.requests_count = 0
+        self.server = HTTPServer(('127.0.0.1', 0), _ServiceUnavailableHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        webhook_data = {
+            'object_kind': 'merge_request',
+            'object_attributes': {'iid': 1, 'target_project_id': 1, 'action': 'open', 'target_branch': 'main'},
+        }
+        self.handler = MergeRequestHandler(webhook_data, 'token', f'http://127.0.0.1:{self.server.server_port}')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_service_unavailable_returns_empty(self):
+        """测试 503 重试耗尽后返回空结果而不是抛出异常"""
+        with patch('urllib3.util.retry.time.sleep'):
+            self.assertEqual(self.handler.get_merge_request_commits(), [])
+            self.assertEqual(self.handler.get_merge_request_changes(), [])
+            self.assertFalse(self.handler.target_branch_protected())
+        # 每个请求重试 3 次，共 4 次请求
+        self.assertEqual(_ServiceUnavailableHandler.requests_count, 12)
+
+
+class TestFilterChanges(TestCase):
+    def test_count_additions_and_deletions(self):
+        """测试新增、删除行数统计，忽略 +++/--- 文件头"""
+        diff = '--- a/app.py\n+++ b/app.py\n@@ -1,2 +1,2 @@\n-old\n+new\n++i\n context'
+        changes = filter_changes([{'new_path': 'app.py', 'diff': diff}])
+        self.assertEqual(changes[0]['additions'], 2)
+        self.assertEqual(changes[0]['deletions'], 1)
+
+
+class TestBranchPatterns(TestCase):
+    def test_match_literal_and_glob_patterns(self):
+        """测试受保护分支的普通名称与通配符规则匹配"""
+        patterns = split_branch_patterns(['main', 'release/*', 'v?.x'])
+        self.assertTrue(match_branch_patterns('main', patterns))
+        self.assertTrue(match_branch_patterns('release/1.0', patterns))
+        self.assertTrue(match_branch_patterns('v1.x', patterns))
+        self.assertFalse(match_branch_patterns('main-old', patterns))
+        self.assertFalse(match_branch_patterns('release', patterns))
+
+
+class TestSlugifyUrl(TestCase):
+    def test_slugify_url(self):
+        """测试URL转换为slug"""
+        self.assertEqual(slugify_url('http://example.com/path/to/repo/'), 'example_com_path_to_repo')
+        self.assertEqual(slugify_url('https://gitlab.com/user/repo.git'), 'gitlab_com_user_repo_git')
+        self.assertEqual(slugify_url('https://gitlab.例子.com/'), 'gitlab____com')
+
 
 if __name__ == '__main__':
     main()
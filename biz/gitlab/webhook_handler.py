@@ -1,32 +1,90 @@
-import os
 import re
 import time
-from urllib.parse import urljoin
+from urllib.parse import urlencode
 import fnmatch
+import logging
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from biz.utils.file_util import SUPPORTED_EXTENSIONS
 from biz.utils.log import logger
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时使用标准库解析
+    orjson = None
 
-def filter_changes(changes: list):
+_URL_SCHEME_PATTERN = re.compile(r'^https?://')
+_NON_ALNUM_PATTERN = re.compile(r'[^a-zA-Z0-9]')
+# ASCII 字符转换表：非字母数字字符替换为下划线
+_SLUG_TABLE = str.maketrans({c: '_' for c in map(chr, range(128)) if not c.isalnum()})
+
+# GitLab API 请求超时时间（连接超时, 读取超时），单位：秒
+REQUEST_TIMEOUT = (3, 30)
+
+# 所有请求均使用 verify=False，导入时统一关闭 InsecureRequestWarning，避免每次请求都输出告警
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 复用连接池的 Session，避免每次请求都重新建立 TCP/TLS 连接
+# GET 请求遇到 502/503/504 时自动重试，重试耗尽后返回最后一次响应（不抛异常），由调用方按状态码处理
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                       max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                         allowed_methods=frozenset(['GET']), raise_on_status=False))
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+
+def get_session() -> requests.Session:
     '''
-    过滤数据，只保留支持的文件类型以及必要的字段信息
+    获取访问 GitLab API 的共享 Session，测试时可替换为 mock 对象
+    '''
+    return _session
+
+
+def parse_json(response: requests.Response):
+    '''
+    解析 GitLab API 响应的 JSON 内容，优先使用更快的 orjson
+    '''
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def count_diff_lines(diff: str, marker: str) -> int:
+    '''
+    统计diff中以marker（'+' 或 '-'）开头的行数，不包含 '+++' / '---' 文件头
     '''
-    # 从环境变量中获取支持的文件扩展名
-    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
+    header = marker * 3
+    count = diff.count('\n' + marker) - diff.count('\n' + header)
+    if diff.startswith(marker) and not diff.startswith(header):
+        count += 1
+    return count
 
-    filter_deleted_files_changes = [change for change in changes if not change.get("deleted_file")]
 
-    # 过滤 `new_path` 以支持的扩展名结尾的元素, 仅保留diff和new_path字段
+def _is_reviewable(change: dict) -> bool:
+    '''
+    判断变更是否需要review：未被删除且文件扩展名在支持列表中
+    '''
+    return not change.get('deleted_file') and change.get('new_path', '').endswith(SUPPORTED_EXTENSIONS)
+
+
+def filter_changes(changes: list):
+    '''
+    过滤数据，只保留支持的文件类型以及必要的字段信息
+    '''
+    # 过滤已删除的文件以及 `new_path` 不以支持的扩展名结尾的元素, 仅保留diff和new_path字段
     filtered_changes = [
         {
             'diff': item.get('diff', ''),
             'new_path': item['new_path'],
-            'additions': len(re.findall(r'^\+(?!\+\+)', item.get('diff', ''), re.MULTILINE)),
-            'deletions': len(re.findall(r'^-(?!--)', item.get('diff', ''), re.MULTILINE))
+            'additions': count_diff_lines(item.get('diff', ''), '+'),
+            'deletions': count_diff_lines(item.get('diff', ''), '-')
         }
-        for item in filter_deleted_files_changes
-        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
+        for item in changes
+        if _is_reviewable(item)
     ]
     return filtered_changes
 
@@ -38,10 +96,13 @@ def slugify_url(original_url: str) -> str:
     slugify_url("https://gitlab.com/user/repo.git") => gitlab_com_user_repo_git
     """
     # Remove URL scheme (http, https, etc.) if present
-    original_url = re.sub(r'^https?://', '', original_url)
+    original_url = _URL_SCHEME_PATTERN.sub('', original_url)
 
     # Replace non-alphanumeric characters (except underscore) with underscores
-    target = re.sub(r'[^a-zA-Z0-9]', '_', original_url)
+    if original_url.isascii():
+        target = original_url.translate(_SLUG_TABLE)
+    else:
+        target = _NON_ALNUM_PATTERN.sub('_', original_url)
 
     # Remove trailing underscore if present
     target = target.rstrip('_')
@@ -49,6 +110,26 @@ def slugify_url(original_url: str) -> str:
     return target
 
 
+def split_branch_patterns(patterns: list) -> tuple:
+    '''
+    将受保护分支规则拆分为普通分支名集合和通配符规则（编译后的正则）列表，
+    普通分支名可直接用集合判断，避免每次都通过 fnmatch 编译正则
+    '''
+    literals = set()
+    globs = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            globs.append(re.compile(fnmatch.translate(pattern)))
+        else:
+            literals.add(pattern)
+    return frozenset(literals), globs
+
+
+def match_branch_patterns(branch: str, branch_patterns: tuple) -> bool:
+    literals, globs = branch_patterns
+    return branch in literals or any(glob.match(branch) for glob in globs)
+
+
 class MergeRequestHandler:
     def __init__(self, webhook_data: dict, gitlab_token: str, gitlab_url: str):
         self.merge_request_iid = None
@@ -58,6 +139,11 @@ class MergeRequestHandler:
         self.event_type = None
         self.project_id = None
         self.action = None
+        self._protected_branch_patterns = None
+        self.api_base = f"{self.gitlab_url.rstrip('/')}/api/v4/projects/"
+        self.headers = {
+            'Private-Token': self.gitlab_token
+        }
         self.parse_event_type()
 
     def parse_event_type(self):
@@ -82,28 +168,27 @@ class MergeRequestHandler:
         # Gitlab merge request changes API可能存在延迟，多次尝试
         max_retries = 3  # 最大重试次数
         retry_delay = 10  # 重试间隔时间（秒）
+        url = f"{self.api_base}{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true"
+        session = get_session()
         for attempt in range(max_retries):
-            # 调用 GitLab API 获取 Merge Request 的 changes
-            url = urljoin(f"{self.gitlab_url}/",
-                          f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true")
-            headers = {
-                'Private-Token': self.gitlab_token
-            }
-            response = requests.get(url, headers=headers, verify=False)
-            logger.debug(
-                f"Get changes response from GitLab (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
+            # 调用 GitLab API 获取 Merge Request 的 changes，重试时复用同一个 keep-alive 连接
+            response = session.get(url, headers=self.headers, verify=False, timeout=REQUEST_TIMEOUT)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Get changes response from GitLab (attempt %s): %s, %s, URL: %s",
+                             attempt + 1, response.status_code, response.text, url)
 
             # 检查请求是否成功
             if response.status_code == 200:
-                changes = response.json().get('changes', [])
+                changes = parse_json(response).get('changes', [])
                 if changes:
-                    return changes
+                    # 尽早丢弃已删除文件和不支持类型文件的diff，避免大段无用diff继续占用内存
+                    return [change for change in changes if _is_reviewable(change)]
                 else:
                     logger.info(
                         f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
                     time.sleep(retry_delay)
             else:
-                logger.warn(f"Failed to get changes from GitLab (URL: {url}): {response.status_code}, {response.text}")
+                logger.warn("Failed to get changes from GitLab (URL: %s): %s, %s", url, response.status_code, response.text)
                 return []
 
         logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
@@ -115,32 +200,25 @@ class MergeRequestHandler:
             return []
 
         # 调用 GitLab API 获取 Merge Request 的 commits
-        url = urljoin(f"{self.gitlab_url}/",
-                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/commits")
-        headers = {
-            'Private-Token': self.gitlab_token
-        }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(f"Get commits response from gitlab: {response.status_code}, {response.text}")
+        url = f"{self.api_base}{self.project_id}/merge_requests/{self.merge_request_iid}/commits"
+        response = get_session().get(url, headers=self.headers, verify=False, timeout=REQUEST_TIMEOUT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Get commits response from gitlab: %s, %s", response.status_code, response.text)
         # 检查请求是否成功
         if response.status_code == 200:
-            return response.json()
+            return parse_json(response)
         else:
-            logger.warn(f"Failed to get commits: {response.status_code}, {response.text}")
+            logger.warn("Failed to get commits: %s, %s", response.status_code, response.text)
             return []
 
     def add_merge_request_notes(self, review_result):
-        url = urljoin(f"{self.gitlab_url}/",
-                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/notes")
-        headers = {
-            'Private-Token': self.gitlab_token,
-            'Content-Type': 'application/json'
-        }
+        url = f"{self.api_base}{self.project_id}/merge_requests/{self.merge_request_iid}/notes"
         data = {
             'body': review_result
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        logger.debug(f"Add notes to gitlab {url}: {response.status_code}, {response.text}")
+        response = get_session().post(url, headers=self.headers, json=data, verify=False, timeout=REQUEST_TIMEOUT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Add notes to gitlab %s: %s, %s", url, response.status_code, response.text)
         if response.status_code == 201:
             logger.info("Note successfully added to merge request.")
         else:
@@ -148,22 +226,19 @@ class MergeRequestHandler:
             logger.error(response.text)
 
     def target_branch_protected(self) -> bool:
-        url = urljoin(f"{self.gitlab_url}/",
-                      f"api/v4/projects/{self.project_id}/protected_branches")
-        headers = {
-            'Private-Token': self.gitlab_token,
-            'Content-Type': 'application/json'
-        }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(f"Get protected branches response from gitlab: {response.status_code}, {response.text}")
-        # 检查请求是否成功
-        if response.status_code == 200:
-            data = response.json()
-            target_branch = self.webhook_data['object_attributes']['target_branch']
-            return any(fnmatch.fnmatch(target_branch, item['name']) for item in data)
-        else:
-            logger.warn(f"Failed to get protected branches: {response.status_code}, {response.text}")
-            return False
+        if self._protected_branch_patterns is None:
+            url = f"{self.api_base}{self.project_id}/protected_branches"
+            response = get_session().get(url, headers=self.headers, verify=False, timeout=REQUEST_TIMEOUT)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Get protected branches response from gitlab: %s, %s", response.status_code, response.text)
+            # 检查请求是否成功
+            if response.status_code != 200:
+                logger.warn("Failed to get protected branches: %s, %s", response.status_code, response.text)
+                return False
+            self._protected_branch_patterns = split_branch_patterns([item['name'] for item in parse_json(response)])
+
+        target_branch = self.webhook_data['object_attributes']['target_branch']
+        return match_branch_patterns(target_branch, self._protected_branch_patterns)
 
 
 class PushHandler:
@@ -175,6 +250,10 @@ class PushHandler:
         self.project_id = None
         self.branch_name = None
         self.commit_list = []
+        self.api_base = f"{self.gitlab_url.rstrip('/')}/api/v4/projects/"
+        self.headers = {
+            'Private-Token': self.gitlab_token
+        }
         self.parse_event_type()
 
     def parse_event_type(self):
@@ -221,17 +300,13 @@ class PushHandler:
             logger.error("Last commit ID not found.")
             return
 
-        url = urljoin(f"{self.gitlab_url}/",
-                      f"api/v4/projects/{self.project_id}/repository/commits/{last_commit_id}/comments")
-        headers = {
-            'Private-Token': self.gitlab_token,
-            'Content-Type': 'application/json'
-        }
+        url = f"{self.api_base}{self.project_id}/repository/commits/{last_commit_id}/comments"
         data = {
             'note': message
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        logger.debug(f"Add comment to commit {last_commit_id}: {response.status_code}, {response.text}")
+        response = get_session().post(url, headers=self.headers, json=data, verify=False, timeout=REQUEST_TIMEOUT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Add comment to commit %s: %s, %s", last_commit_id, response.status_code, response.text)
         if response.status_code == 201:
             logger.info("Comment successfully added to push commit.")
         else:
@@ -241,19 +316,17 @@ class PushHandler:
     def __repository_commits(self, ref_name: str = "", since: str = "", until: str = "", pre_page: int = 100,
                              page: int = 1):
         # 获取仓库提交信息
-        url = f"{urljoin(f'{self.gitlab_url}/', f'api/v4/projects/{self.project_id}/repository/commits')}?ref_name={ref_name}&since={since}&until={until}&per_page={pre_page}&page={page}"
-        headers = {
-            'Private-Token': self.gitlab_token
-        }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(
-            f"Get commits response from GitLab for repository_commits: {response.status_code}, {response.text}, URL: {url}")
+        params = urlencode({'ref_name': ref_name, 'since': since, 'until': until, 'per_page': pre_page, 'page': page})
+        url = f"{self.api_base}{self.project_id}/repository/commits?{params}"
+        response = get_session().get(url, headers=self.headers, verify=False, timeout=REQUEST_TIMEOUT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Get commits response from GitLab for repository_commits: %s, %s, URL: %s",
+                         response.status_code, response.text, url)
 
         if response.status_code == 200:
-            return response.json()
+            return parse_json(response)
         else:
-            logger.warn(
-                f"Failed to get commits for ref {ref_name}: {response.status_code}, {response.text}")
+            logger.warn("Failed to get commits for ref %s: %s, %s", ref_name, response.status_code, response.text)
             return []
 
     def get_parent_commit_id(self, commit_id: str) -> str:
@@ -264,19 +337,17 @@ class PushHandler:
 
     def repository_compare(self, before: str, after: str):
         # 比较两个提交之间的差异
-        url = f"{urljoin(f'{self.gitlab_url}/', f'api/v4/projects/{self.project_id}/repository/compare')}?from={before}&to={after}"
-        headers = {
-            'Private-Token': self.gitlab_token
-        }
-        response = requests.get(url, headers=headers, verify=False)
-        logger.debug(
-            f"Get changes response from GitLab for repository_compare: {response.status_code}, {response.text}, URL: {url}")
+        params = urlencode({'from': before, 'to': after})
+        url = f"{self.api_base}{self.project_id}/repository/compare?{params}"
+        response = get_session().get(url, headers=self.headers, verify=False, timeout=REQUEST_TIMEOUT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Get changes response from GitLab for repository_compare: %s, %s, URL: %s",
+                         response.status_code, response.text, url)
 
         if response.status_code == 200:
-            return response.json().get('diffs', [])
+            return parse_json(response).get('diffs', [])
         else:
-            logger.warn(
-                f"Failed to get changes for repository_compare: {response.status_code}, {response.text}")
+            logger.warn("Failed to get changes for repository_compare: %s, %s", response.status_code, response.text)
             return []
 
     def get_push_changes(self) -> list:
@@ -289,9 +360,6 @@ class PushHandler:
         if not self.commit_list:
             logger.info("No commits found in push event.")
             return []
-        headers = {
-            'Private-Token': self.gitlab_token
-        }
 
         # 优先尝试compare API获取变更
         before = self.webhook_data.get('before', '')
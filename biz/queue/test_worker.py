@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import MagicMock, patch
+
+from biz.queue.worker import handle_merge_request_event
+
+
+class TestHandleMergeRequestEvent(TestCase):
+    def setUp(self):
+        """设置测试环境，mock 掉 GitLab、LLM、事件分发和通知"""
+        self.webhook_data = {
+            'project': {'name': 'demo'},
+            'user': {'username': 'dev'},
+            'object_attributes': {'source_branch': 'feature', 'target_branch': 'main', 'url': 'http://mr'},
+        }
+        self.handler = MagicMock()
+        self.handler.action = 'open'
+        self.handler.get_merge_request_changes.return_value = [{'new_path': 'app.py', 'diff': '+print(1)'}]
+        self.handler.get_merge_request_commits.return_value = [{'title': 'add app'}]
+        reviewer_cls = MagicMock()
+        reviewer_cls.return_value.review_and_strip_code.return_value = '总分: 90分'
+
+        self.event_manager = MagicMock()
+        self.notifier = MagicMock()
+        patches = [
+            patch('biz.queue.worker.MergeRequestHandler', return_value=self.handler),
+            patch('biz.queue.worker.CodeReviewer', reviewer_cls),
+            patch('biz.queue.worker.event_manager', self.event_manager),
+            patch('biz.queue.worker.notifier', self.notifier),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_notes_added_and_event_sent(self):
+        """测试 Review 结果提交到 notes 并分发事件"""
+        handle_merge_request_event(self.webhook_data, 'token', 'http://gitlab', 'gitlab')
+
+        self.handler.add_merge_request_notes.assert_called_once_with('Auto Review Result: \n总分: 90分')
+        self.event_manager['merge_request_reviewed'].send.assert_called_once()
+        self.notifier.send_notification.assert_not_called()
+
+    def test_notes_error_reaches_notifier(self):
+        """测试提交 notes 失败时异常交由 notifier 通知"""
+        self.handler.add_merge_request_notes.side_effect = RuntimeError('notes failed')
+
+        handle_merge_request_event(self.webhook_data, 'token', 'http://gitlab', 'gitlab')
+
+        self.notifier.send_notification.assert_called_once()
+        self.assertIn('notes failed', self.notifier.send_notification.call_args.kwargs['content'])
+
+    def test_notes_awaited_when_event_dispatch_fails(self):
+        """测试事件分发失败时仍等待 notes 提交完成"""
+        notes_done = threading.Event()
+
+        def add_notes(_):
+            time.sleep(0.1)
+            notes_done.set()
+
+        self.handler.add_merge_request_notes.side_effect = add_notes
+        self.event_manager['merge_request_reviewed'].send.side_effect = RuntimeError('dispatch failed')
+
+        handle_merge_request_event(self.webhook_data, 'token', 'http://gitlab', 'gitlab')
+
+        self.assertTrue(notes_done.is_set())
+        self.assertIn('dispatch failed', self.notifier.send_notification.call_args.kwargs['content'])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
+import json
 import os
+import time
 import traceback
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
 from biz.entity.review_entity import MergeRequestReviewEntity, PushReviewEntity
 from biz.event.event_manager import event_manager
@@ -11,6 +14,19 @@ from biz.utils.code_reviewer import CodeReviewer
 from biz.utils.im import notifier
 from biz.utils.log import logger
 
+# 需要触发 Review 的 MR / PR 动作
+_MR_ACCEPTED_ACTIONS = frozenset({'open', 'update'})
+_GH_ACCEPTED_ACTIONS = frozenset({'opened', 'synchronize'})
+
+# 用于后台提交 Review 结果到 notes，与事件分发并行执行
+_NOTES_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='notes')
+
+
+def _serialize_changes(changes: list) -> str:
+    '''
+    将changes序列化为紧凑的JSON，作为Review提示词中的代码变更内容
+    '''
+    return json.dumps(changes, ensure_ascii=False, separators=(',', ':'))
 
 
 def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gitlab_url_slug: str):
@@ -24,41 +40,47 @@ def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gi
             return
 
         review_result = None
+        notes_future = None
         score = 0
         additions = 0
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
             changes = handler.get_push_changes()
-            logger.info('changes: %s', changes)
+            logger.debug('changes: %s', changes)
             changes = filter_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
-                commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+                commits_text = ';'.join(filter(None, (commit.get('message', '').strip() for commit in commits)))
+                review_result = CodeReviewer().review_and_strip_code(_serialize_changes(changes), commits_text)
                 score = CodeReviewer.parse_review_score(review_text=review_result)
-                for item in changes:
-                    additions += item['additions']
-                    deletions += item['deletions']
-            # 将review结果提交到Gitlab的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
-
-        event_manager['push_reviewed'].send(PushReviewEntity(
-            project_name=webhook_data['project']['name'],
-            author=webhook_data['user_username'],
-            branch=webhook_data.get('ref', '').replace('refs/heads/', ''),
-            updated_at=int(datetime.now().timestamp()),  # 当前时间
-            commits=commits,
-            score=score,
-            review_result=review_result,
-            url_slug=gitlab_url_slug,
-            webhook_data=webhook_data,
-            additions=additions,
-            deletions=deletions,
-        ))
+                additions = sum(map(itemgetter('additions'), changes))
+                deletions = sum(map(itemgetter('deletions'), changes))
+                logger.info('changes: %d files, +%d/-%d', len(changes), additions, deletions)
+            # 将review结果提交到Gitlab的 notes（后台执行，与事件分发并行）
+            notes_future = _NOTES_EXECUTOR.submit(handler.add_push_notes, f'Auto Review Result: \n{review_result}')
+
+        try:
+            event_manager['push_reviewed'].send(PushReviewEntity(
+                project_name=webhook_data['project']['name'],
+                author=webhook_data['user_username'],
+                branch=webhook_data.get('ref', '').removeprefix('refs/heads/'),
+                updated_at=int(time.time()),  # 当前时间
+                commits=commits,
+                score=score,
+                review_result=review_result,
+                url_slug=gitlab_url_slug,
+                webhook_data=webhook_data,
+                additions=additions,
+                deletions=deletions,
+            ))
+        finally:
+            # 无论事件分发是否成功都等待 notes 提交完成，异常交由下方统一处理
+            if notes_future:
+                notes_future.result()
 
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
@@ -81,11 +103,17 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
         handler = MergeRequestHandler(webhook_data, gitlab_token, gitlab_url)
         logger.info('Merge Request Hook event received')
 
+        # 先做本地的动作判断，非 open/update 事件无需后续通知和受保护分支查询
+        if handler.action not in _MR_ACCEPTED_ACTIONS:
+            logger.info(f"Merge Request Hook event, action={handler.action}, ignored.")
+            return
+
         # 新增：判断是否为draft（草稿）MR
         object_attributes = webhook_data.get('object_attributes', {})
+        project_name = webhook_data['project']['name']
         is_draft = object_attributes.get('draft') or object_attributes.get('work_in_progress')
         if is_draft:
-            msg = f"[通知] MR为草稿（draft），未触发AI审查。\n项目: {webhook_data['project']['name']}\n作者: {webhook_data['user']['username']}\n源分支: {object_attributes.get('source_branch')}\n目标分支: {object_attributes.get('target_branch')}\n链接: {object_attributes.get('url')}"
+            msg = f"[通知] MR为草稿（draft），未触发AI审查。\n项目: {project_name}\n作者: {webhook_data['user']['username']}\n源分支: {object_attributes.get('source_branch')}\n目标分支: {object_attributes.get('target_branch')}\n链接: {object_attributes.get('url')}"
             notifier.send_notification(content=msg)
             logger.info("MR为draft，仅发送通知，不触发AI review。")
             return
@@ -95,14 +123,9 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             logger.info("Merge Request target branch not match protected branches, ignored.")
             return
 
-        if handler.action not in ['open', 'update']:
-            logger.info(f"Merge Request Hook event, action={handler.action}, ignored.")
-            return
-
         # 检查last_commit_id是否已经存在，如果存在则跳过处理
         last_commit_id = object_attributes.get('last_commit', {}).get('id', '')
         if last_commit_id:
-            project_name = webhook_data['project']['name']
             source_branch = object_attributes.get('source_branch', '')
             target_branch = object_attributes.get('target_branch', '')
             
@@ -113,17 +136,15 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
         # 仅仅在MR创建或更新时进行Code Review
         # 获取Merge Request的changes
         changes = handler.get_merge_request_changes()
-        logger.info('changes: %s', changes)
+        logger.debug('changes: %s', changes)
         changes = filter_changes(changes)
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
         # 统计本次新增、删除的代码总数
-        additions = 0
-        deletions = 0
-        for item in changes:
-            additions += item.get('additions', 0)
-            deletions += item.get('deletions', 0)
+        additions = sum(map(itemgetter('additions'), changes))
+        deletions = sum(map(itemgetter('deletions'), changes))
+        logger.info('changes: %d files, +%d/-%d', len(changes), additions, deletions)
 
         # 获取Merge Request的commits
         commits = handler.get_merge_request_commits()
@@ -133,30 +154,34 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
 
         # review 代码
         commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        review_result = CodeReviewer().review_and_strip_code(_serialize_changes(changes), commits_text)
 
-        # 将review结果提交到Gitlab的 notes
-        handler.add_merge_request_notes(f'Auto Review Result: \n{review_result}')
+        # 将review结果提交到Gitlab的 notes（后台执行，与事件分发并行）
+        notes_future = _NOTES_EXECUTOR.submit(handler.add_merge_request_notes, f'Auto Review Result: \n{review_result}')
 
         # dispatch merge_request_reviewed event
-        event_manager['merge_request_reviewed'].send(
-            MergeRequestReviewEntity(
-                project_name=webhook_data['project']['name'],
-                author=webhook_data['user']['username'],
-                source_branch=webhook_data['object_attributes']['source_branch'],
-                target_branch=webhook_data['object_attributes']['target_branch'],
-                updated_at=int(datetime.now().timestamp()),
-                commits=commits,
-                score=CodeReviewer.parse_review_score(review_text=review_result),
-                url=webhook_data['object_attributes']['url'],
-                review_result=review_result,
-                url_slug=gitlab_url_slug,
-                webhook_data=webhook_data,
-                additions=additions,
-                deletions=deletions,
-                last_commit_id=last_commit_id,
+        try:
+            event_manager['merge_request_reviewed'].send(
+                MergeRequestReviewEntity(
+                    project_name=project_name,
+                    author=webhook_data['user']['username'],
+                    source_branch=object_attributes['source_branch'],
+                    target_branch=object_attributes['target_branch'],
+                    updated_at=int(time.time()),
+                    commits=commits,
+                    score=CodeReviewer.parse_review_score(review_text=review_result),
+                    url=object_attributes['url'],
+                    review_result=review_result,
+                    url_slug=gitlab_url_slug,
+                    webhook_data=webhook_data,
+                    additions=additions,
+                    deletions=deletions,
+                    last_commit_id=last_commit_id,
+                )
             )
-        )
+        finally:
+            # 无论事件分发是否成功都等待 notes 提交完成，异常交由下方统一处理
+            notes_future.result()
 
     except Exception as e:
         error_message = f'AI Code Review 服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
@@ -174,41 +199,47 @@ def handle_github_push_event(webhook_data: dict, github_token: str, github_url:
             return
 
         review_result = None
+        notes_future = None
         score = 0
         additions = 0
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
             changes = handler.get_push_changes()
-            logger.info('changes: %s', changes)
+            logger.debug('changes: %s', changes)
             changes = filter_github_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
-                commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+                commits_text = ';'.join(filter(None, (commit.get('message', '').strip() for commit in commits)))
+                review_result = CodeReviewer().review_and_strip_code(_serialize_changes(changes), commits_text)
                 score = CodeReviewer.parse_review_score(review_text=review_result)
-                for item in changes:
-                    additions += item.get('additions', 0)
-                    deletions += item.get('deletions', 0)
-            # 将review结果提交到GitHub的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
-
-        event_manager['push_reviewed'].send(PushReviewEntity(
-            project_name=webhook_data['repository']['name'],
-            author=webhook_data['sender']['login'],
-            branch=webhook_data['ref'].replace('refs/heads/', ''),
-            updated_at=int(datetime.now().timestamp()),  # 当前时间
-            commits=commits,
-            score=score,
-            review_result=review_result,
-            url_slug=github_url_slug,
-            webhook_data=webhook_data,
-            additions=additions,
-            deletions=deletions,
-        ))
+                additions = sum(map(itemgetter('additions'), changes))
+                deletions = sum(map(itemgetter('deletions'), changes))
+                logger.info('changes: %d files, +%d/-%d', len(changes), additions, deletions)
+            # 将review结果提交到GitHub的 notes（后台执行，与事件分发并行）
+            notes_future = _NOTES_EXECUTOR.submit(handler.add_push_notes, f'Auto Review Result: \n{review_result}')
+
+        try:
+            event_manager['push_reviewed'].send(PushReviewEntity(
+                project_name=webhook_data['repository']['name'],
+                author=webhook_data['sender']['login'],
+                branch=webhook_data['ref'].removeprefix('refs/heads/'),
+                updated_at=int(time.time()),  # 当前时间
+                commits=commits,
+                score=score,
+                review_result=review_result,
+                url_slug=github_url_slug,
+                webhook_data=webhook_data,
+                additions=additions,
+                deletions=deletions,
+            ))
+        finally:
+            # 无论事件分发是否成功都等待 notes 提交完成，异常交由下方统一处理
+            if notes_future:
+                notes_future.result()
 
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
@@ -230,22 +261,23 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
         # 解析Webhook数据
         handler = GithubPullRequestHandler(webhook_data, github_token, github_url)
         logger.info('GitHub Pull Request event received')
+        # 先做本地的动作判断，避免无关事件触发受保护分支查询
+        if handler.action not in _GH_ACCEPTED_ACTIONS:
+            logger.info(f"Pull Request Hook event, action={handler.action}, ignored.")
+            return
+
         # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
         if merge_review_only_protected_branches and not handler.target_branch_protected():
             logger.info("Merge Request target branch not match protected branches, ignored.")
             return
 
-        if handler.action not in ['opened', 'synchronize']:
-            logger.info(f"Pull Request Hook event, action={handler.action}, ignored.")
-            return
-
         # 检查GitHub Pull Request的last_commit_id是否已经存在，如果存在则跳过处理
-        github_last_commit_id = webhook_data['pull_request']['head']['sha']
+        pull_request = webhook_data['pull_request']
+        project_name = webhook_data['repository']['name']
+        source_branch = pull_request['head']['ref']
+        target_branch = pull_request['base']['ref']
+        github_last_commit_id = pull_request['head']['sha']
         if github_last_commit_id:
-            project_name = webhook_data['repository']['name']
-            source_branch = webhook_data['pull_request']['head']['ref']
-            target_branch = webhook_data['pull_request']['base']['ref']
-            
             if ReviewService.check_mr_last_commit_id_exists(project_name, source_branch, target_branch, github_last_commit_id):
                 logger.info(f"Pull Request with last_commit_id {github_last_commit_id} already exists, skipping review for {project_name}.")
                 return
@@ -253,17 +285,15 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
         # 仅仅在PR创建或更新时进行Code Review
         # 获取Pull Request的changes
         changes = handler.get_pull_request_changes()
-        logger.info('changes: %s', changes)
+        logger.debug('changes: %s', changes)
         changes = filter_github_changes(changes)
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
         # 统计本次新增、删除的代码总数
-        additions = 0
-        deletions = 0
-        for item in changes:
-            additions += item.get('additions', 0)
-            deletions += item.get('deletions', 0)
+        additions = sum(map(itemgetter('additions'), changes))
+        deletions = sum(map(itemgetter('deletions'), changes))
+        logger.info('changes: %d files, +%d/-%d', len(changes), additions, deletions)
 
         # 获取Pull Request的commits
         commits = handler.get_pull_request_commits()
@@ -273,29 +303,33 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
 
         # review 代码
         commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        review_result = CodeReviewer().review_and_strip_code(_serialize_changes(changes), commits_text)
 
-        # 将review结果提交到GitHub的 notes
-        handler.add_pull_request_notes(f'Auto Review Result: \n{review_result}')
+        # 将review结果提交到GitHub的 notes（后台执行，与事件分发并行）
+        notes_future = _NOTES_EXECUTOR.submit(handler.add_pull_request_notes, f'Auto Review Result: \n{review_result}')
 
         # dispatch pull_request_reviewed event
-        event_manager['merge_request_reviewed'].send(
-            MergeRequestReviewEntity(
-                project_name=webhook_data['repository']['name'],
-                author=webhook_data['pull_request']['user']['login'],
-                source_branch=webhook_data['pull_request']['head']['ref'],
-                target_branch=webhook_data['pull_request']['base']['ref'],
-                updated_at=int(datetime.now().timestamp()),
-                commits=commits,
-                score=CodeReviewer.parse_review_score(review_text=review_result),
-                url=webhook_data['pull_request']['html_url'],
-                review_result=review_result,
-                url_slug=github_url_slug,
-                webhook_data=webhook_data,
-                additions=additions,
-                deletions=deletions,
-                last_commit_id=github_last_commit_id,
-            ))
+        try:
+            event_manager['merge_request_reviewed'].send(
+                MergeRequestReviewEntity(
+                    project_name=project_name,
+                    author=pull_request['user']['login'],
+                    source_branch=source_branch,
+                    target_branch=target_branch,
+                    updated_at=int(time.time()),
+                    commits=commits,
+                    score=CodeReviewer.parse_review_score(review_text=review_result),
+                    url=pull_request['html_url'],
+                    review_result=review_result,
+                    url_slug=github_url_slug,
+                    webhook_data=webhook_data,
+                    additions=additions,
+                    deletions=deletions,
+                    last_commit_id=github_last_commit_id,
+                ))
+        finally:
+            # 无论事件分发是否成功都等待 notes 提交完成，异常交由下方统一处理
+            notes_future.result()
 
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
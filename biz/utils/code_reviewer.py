@@ -10,6 +10,9 @@ from biz.llm.factory import Factory
 from biz.utils.log import logger
 from biz.utils.token_util import count_tokens, truncate_text_by_tokens
 
+# 匹配 AI 返回结果中的总分，例如 “总分：85分”
+_REVIEW_SCORE_PATTERN = re.compile(r"总分[:：]\s*(\d+)分?")
+
 
 class BaseReviewer(abc.ABC):
     """代码审查基类"""
@@ -103,6 +106,6 @@ class CodeReviewer(BaseReviewer):
         """解析 AI 返回的 Review 结果，返回评分"""
         if not review_text:
             return 0
-        match = re.search(r"总分[:：]\s*(\d+)分?", review_text)
+        match = _REVIEW_SCORE_PATTERN.search(review_text)
         return int(match.group(1)) if match else 0
 
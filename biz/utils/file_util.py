@@ -0,0 +1,6 @@
+import os
+
+# 支持review的文件扩展名，进程生命周期内不变，导入时解析一次
+SUPPORTED_EXTENSIONS = tuple(
+    ext.strip() for ext in os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',') if ext.strip()
+)